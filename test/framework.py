@@ -1139,6 +1139,12 @@ class VppTestCase(unittest.TestCase):
         self.pg_enable_capture(self.pg_interfaces)
         self.pg_start()
 
+    def pg_send_raw(self, intf, raw, count, worker=None):
+        self.vapi.cli("clear trace")
+        intf.add_stream_raw(raw, count, worker=worker)
+        self.pg_enable_capture(self.pg_interfaces)
+        self.pg_start()
+
     def send_and_assert_no_replies(self, intf, pkts, remark="", timeout=None):
         self.pg_send(intf, pkts)
         if not timeout:
@@ -1155,6 +1161,14 @@ class VppTestCase(unittest.TestCase):
         rx = output.get_capture(n_rx)
         return rx
 
+    def send_raw_and_expect(self, intf, raw, count, output, n_rx=None,
+                            worker=None):
+        if not n_rx:
+            n_rx = count
+        self.pg_send_raw(intf, raw, count, worker=worker)
+        rx = output.get_capture(n_rx)
+        return rx
+
     def send_and_expect_only(self, intf, pkts, output, timeout=None):
         self.pg_send(intf, pkts)
         rx = output.get_capture(len(pkts))
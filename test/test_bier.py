@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 
+import binascii
+import struct
 import unittest
+from collections import namedtuple
+from ipaddress import IPv4Address
 
 from framework import VppTestCase, VppTestRunner, running_extended_tests
 from vpp_ip import DpoProto
-from vpp_ip_route import VppIpRoute, VppRoutePath, \
-    VppMplsTable, VppIpMRoute, VppMRoutePath, VppIpTable, \
-    MRouteEntryFlags, MRouteItfFlags, MPLS_LABEL_INVALID, \
+from vpp_ip_route import VppIpRoute, VppRoutePath, VppIpMRoute, \
+    VppMRoutePath, MRouteEntryFlags, MRouteItfFlags, MPLS_LABEL_INVALID, \
     VppMplsLabel, FibPathProto, FibPathType
 from vpp_bier import BIER_HDR_PAYLOAD, VppBierImp, VppBierDispEntry, \
     VppBierDispTable, VppBierTable, VppBierTableID, VppBierRoute
@@ -22,6 +25,58 @@ from scapy.contrib.bier import BIER, BIERLength, BIFT
 
 NUM_PKTS = 67
 
+# BSL:256 bit-strings
+BS_ALL = b'\xff' * 32
+BS_3 = b'\x03' * 32
+
+# the unspecified next-hop of the for-us and UDP-encap paths
+NH_ANY = IPv4Address(u"0.0.0.0")
+
+# offset of the BIER header in an Ether/MPLS/MPLS/BIER frame
+BIER_OFFSET = 14 + 4 + 4
+
+
+def _layers(p):
+    """ Index a packet's layers by class name, so repeated lookups do not
+        re-walk the layer chain. Only the outermost instance is kept. """
+    layers = {}
+    while p:
+        layers.setdefault(p.__class__.__name__, p)
+        p = p.payload
+    return layers
+
+
+# the fields of a received Ether/MPLS/MPLS/BIER frame
+BierRx = namedtuple('BierRx', ['ethertype', 'olabel', 'os', 'blabel', 'bs',
+                               'bttl', 'id', 'version', 'length', 'entropy',
+                               'oam', 'rsv', 'dscp', 'proto', 'bitstring'])
+
+
+def _decode_bier_rx(rxp, n_bytes):
+    """ Decode the labels and BIER header of an Ether/MPLS/MPLS/BIER
+        frame directly from its bytes, rather than walking Scapy layers.
+
+    :returns: BierRx
+    """
+    buf = bytes(rxp)
+    ethertype, olabel, blabel, w0, w1 = struct.unpack_from("!HIIII",
+                                                           buf, 12)
+    return BierRx(ethertype=ethertype,
+                  olabel=olabel >> 12,
+                  os=(olabel >> 8) & 0x1,
+                  blabel=blabel >> 12,
+                  bs=(blabel >> 8) & 0x1,
+                  bttl=blabel & 0xff,
+                  id=w0 >> 28,
+                  version=(w0 >> 24) & 0xf,
+                  length=(w0 >> 20) & 0xf,
+                  entropy=w0 & 0xfffff,
+                  oam=w1 >> 30,
+                  rsv=(w1 >> 28) & 0x3,
+                  dscp=(w1 >> 22) & 0x3f,
+                  proto=(w1 >> 16) & 0x3f,
+                  bitstring=buf[BIER_OFFSET + 8:BIER_OFFSET + 8 + n_bytes])
+
 
 class TestBFIB(VppTestCase):
     """ BIER FIB Test Case """
@@ -38,38 +93,48 @@ class TestBFIB(VppTestCase):
 class TestBier(VppTestCase):
     """ BIER Test Case """
 
-    def setUp(self):
-        super(TestBier, self).setUp()
-
-        # create 2 pg interfaces
-        self.create_pg_interfaces(range(3))
-
-        # create the default MPLS table
-        self.tables = []
-        tbl = VppMplsTable(self, 0)
-        tbl.add_vpp_config()
-        self.tables.append(tbl)
-
-        tbl = VppIpTable(self, 10)
-        tbl.add_vpp_config()
-        self.tables.append(tbl)
-
-        # setup both interfaces
-        for i in self.pg_interfaces:
-            if i == self.pg2:
-                i.set_table_ip4(10)
-            i.admin_up()
-            i.config_ip4()
-            i.resolve_arp()
-            i.enable_mpls()
-
-    def tearDown(self):
-        for i in self.pg_interfaces:
-            i.disable_mpls()
-            i.unconfig_ip4()
-            i.set_table_ip4(0)
-            i.admin_down()
-        super(TestBier, self).tearDown()
+    # BIER table IDs for sub-domain 0/1, set 0, BSL 256
+    BTI_SD0 = VppBierTableID(0, 0, BIERLength.BIER_LEN_256)
+    BTI_SD1 = VppBierTableID(1, 0, BIERLength.BIER_LEN_256)
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestBier, cls).setUpClass()
+
+        try:
+            # create 3 pg interfaces
+            cls.create_pg_interfaces(range(3))
+
+            # create the default MPLS table and IP table 10. These are
+            # shared by all the tests, so they are not registered for the
+            # per-test auto-cleanup.
+            cls.vapi.mpls_table_add_del(0, is_add=1)
+            cls.vapi.ip_table_add_del(is_add=1, table={'table_id': 10})
+
+            # setup all interfaces
+            for i in cls.pg_interfaces:
+                if i == cls.pg2:
+                    i.set_table_ip4(10)
+                i.admin_up()
+                i.config_ip4()
+                i.resolve_arp()
+                i.enable_mpls()
+        except Exception:
+            super(TestBier, cls).tearDownClass()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        if not cls.vpp_dead:
+            for i in cls.pg_interfaces:
+                i.disable_mpls()
+                i.unconfig_ip4()
+                i.set_table_ip4(0)
+                i.admin_down()
+            cls.vapi.ip_table_add_del(is_add=0, table={'table_id': 10})
+            cls.vapi.mpls_table_add_del(0, is_add=0)
+
+        super(TestBier, cls).tearDownClass()
 
     def bier_midpoint(self, hdr_len_id, n_bytes, max_bp):
         """BIER midpoint"""
@@ -88,8 +153,7 @@ class TestBier(VppTestCase):
              MPLS(label=77, ttl=255) /
              BIER(length=hdr_len_id) /
              IPv6(src=self.pg0.remote_ip6, dst=self.pg0.remote_ip6) /
-             UDP(sport=1234, dport=1234) /
-             Raw())
+             UDP(sport=1234, dport=1234))
         pkts = [p]
 
         self.send_and_assert_no_replies(self.pg0, pkts,
@@ -102,20 +166,27 @@ class TestBier(VppTestCase):
         #
         nh_routes = []
         bier_routes = []
-        for i in range(1, max_bp+1):
-            nh = "10.0.%d.%d" % (i / 255, i % 255)
+        nhs = ["10.0.%d.%d" % divmod(i, 256) for i in range(1, max_bp+1)]
+        for i, nh in enumerate(nhs, 1):
             nh_routes.append(
                 VppIpRoute(self, nh, 32,
                            [VppRoutePath(self.pg1.remote_ip4,
                                          self.pg1.sw_if_index,
                                          labels=[VppMplsLabel(2000+i)])]))
-            nh_routes[-1].add_vpp_config()
-
             bier_routes.append(
                 VppBierRoute(self, bti, i,
                              [VppRoutePath(nh, 0xffffffff,
                                            labels=[VppMplsLabel(100+i)])]))
-            bier_routes[-1].add_vpp_config()
+
+        #
+        # add the next-hops first so each BIER route resolves on add.
+        # the adds are issued serially; the API client reads replies on
+        # the calling thread, so they cannot be spread over workers.
+        #
+        for nhr in nh_routes:
+            nhr.add_vpp_config()
+        for br in bier_routes:
+            br.add_vpp_config()
 
         #
         # A packet with all bits set gets replicated once for each bit
@@ -130,12 +201,13 @@ class TestBier(VppTestCase):
                  IPv6(src=self.pg0.remote_ip6, dst=self.pg0.remote_ip6) /
                  UDP(sport=1234, dport=1234) /
                  Raw(scapy.compat.chb(5) * pkt_size))
-            pkts = p
 
-            self.pg0.add_stream(pkts)
+            self.pg0.add_stream([p])
             self.pg_enable_capture(self.pg_interfaces)
             self.pg_start()
 
+            self.assertTrue(self.pg1.wait_for_n_packets(max_bp),
+                            "%d replicas not captured on pg1" % max_bp)
             rx = self.pg1.get_capture(max_bp)
 
             for rxp in rx:
@@ -144,33 +216,31 @@ class TestBier(VppTestCase):
                 # when we setup the routes above we used the bit-position to
                 # construct the out-label. so use that here to determine the BP
                 #
-                olabel = rxp[MPLS]
-                bp = olabel.label - 2000
+                hdr = _decode_bier_rx(rxp, n_bytes)
 
-                blabel = olabel[MPLS].payload
-                self.assertEqual(blabel.label, 100+bp)
-                self.assertEqual(blabel.ttl, 254)
+                # Encap Stack is; eth, MPLS, MPLS, BIER
+                self.assertEqual(hdr.ethertype, 0x8847)
+                self.assertEqual(hdr.os, 0)
+                self.assertEqual(hdr.bs, 1)
 
-                bier_hdr = blabel[MPLS].payload
+                bp = hdr.olabel - 2000
 
-                self.assertEqual(bier_hdr.id, 5)
-                self.assertEqual(bier_hdr.version, 0)
-                self.assertEqual(bier_hdr.length, hdr_len_id)
-                self.assertEqual(bier_hdr.entropy, 0)
-                self.assertEqual(bier_hdr.OAM, 0)
-                self.assertEqual(bier_hdr.RSV, 0)
-                self.assertEqual(bier_hdr.DSCP, 0)
-                self.assertEqual(bier_hdr.Proto, 5)
+                self.assertEqual(hdr.blabel, 100+bp)
+                self.assertEqual(hdr.bttl, 254)
 
-                # The bit-string should consist only of the BP given by i.
-                byte_array = [b'\0'] * (n_bytes)
-                byte_val = scapy.compat.chb(1 << (bp - 1) % 8)
-                byte_pos = n_bytes - (((bp - 1) // 8) + 1)
-                byte_array[byte_pos] = byte_val
-                bitstring = b''.join(byte_array)
+                self.assertEqual(hdr.id, 5)
+                self.assertEqual(hdr.version, 0)
+                self.assertEqual(hdr.length, hdr_len_id)
+                self.assertEqual(hdr.entropy, 0)
+                self.assertEqual(hdr.oam, 0)
+                self.assertEqual(hdr.rsv, 0)
+                self.assertEqual(hdr.dscp, 0)
+                self.assertEqual(hdr.proto, 5)
 
-                self.assertEqual(len(bitstring), len(bier_hdr.BitString))
-                self.assertEqual(bitstring, bier_hdr.BitString)
+                # The bit-string should consist only of the BP given by i.
+                self.assertEqual(len(hdr.bitstring), n_bytes)
+                self.assertEqual(int(binascii.hexlify(hdr.bitstring), 16),
+                                 1 << (bp - 1))
 
         #
         # cleanup. not strictly necessary, but it's much quicker this way
@@ -229,8 +299,7 @@ class TestBier(VppTestCase):
                               BitString=scapy.compat.chb(255)*16) /
                          IPv6(src=self.pg0.remote_ip6,
                               dst=self.pg0.remote_ip6) /
-                         UDP(sport=1234, dport=1234) /
-                         Raw()))
+                         UDP(sport=1234, dport=1234)))
 
         #
         # 4 next hops
@@ -307,7 +376,7 @@ class TestBier(VppTestCase):
         #
         # Add a BIER table for sub-domain 0, set 0, and BSL 256
         #
-        bti = VppBierTableID(0, 0, BIERLength.BIER_LEN_256)
+        bti = self.BTI_SD0
         bt = VppBierTable(self, bti, 77)
         bt.add_vpp_config()
 
@@ -339,7 +408,7 @@ class TestBier(VppTestCase):
         #
         # An imposition object with both bit-positions set
         #
-        bi = VppBierImp(self, bti, 333, scapy.compat.chb(0x3) * 32)
+        bi = VppBierImp(self, bti, 333, BS_3)
         bi.add_vpp_config()
 
         #
@@ -378,24 +447,18 @@ class TestBier(VppTestCase):
         # Encap Stack is; eth, MPLS, MPLS, BIER
         #
         igp_mpls = rx[0][MPLS]
-        self.assertEqual(igp_mpls.label, 2001)
-        self.assertEqual(igp_mpls.ttl, 64)
-        self.assertEqual(igp_mpls.s, 0)
         bier_mpls = igp_mpls[MPLS].payload
-        self.assertEqual(bier_mpls.label, 101)
-        self.assertEqual(bier_mpls.ttl, 64)
-        self.assertEqual(bier_mpls.s, 1)
-        self.assertEqual(rx[0][BIER].length, 2)
+        self.assertEqual((igp_mpls.label, igp_mpls.ttl, igp_mpls.s,
+                          bier_mpls.label, bier_mpls.ttl, bier_mpls.s,
+                          rx[0][BIER].length),
+                         (2001, 64, 0, 101, 64, 1, 2))
 
         igp_mpls = rx[1][MPLS]
-        self.assertEqual(igp_mpls.label, 2002)
-        self.assertEqual(igp_mpls.ttl, 64)
-        self.assertEqual(igp_mpls.s, 0)
         bier_mpls = igp_mpls[MPLS].payload
-        self.assertEqual(bier_mpls.label, 102)
-        self.assertEqual(bier_mpls.ttl, 64)
-        self.assertEqual(bier_mpls.s, 1)
-        self.assertEqual(rx[0][BIER].length, 2)
+        self.assertEqual((igp_mpls.label, igp_mpls.ttl, igp_mpls.s,
+                          bier_mpls.label, bier_mpls.ttl, bier_mpls.s,
+                          rx[1][BIER].length),
+                         (2002, 64, 0, 102, 64, 1, 2))
 
     def test_bier_tail(self):
         """BIER Tail"""
@@ -403,7 +466,7 @@ class TestBier(VppTestCase):
         #
         # Add a BIER table for sub-domain 0, set 0, and BSL 256
         #
-        bti = VppBierTableID(0, 0, BIERLength.BIER_LEN_256)
+        bti = self.BTI_SD0
         bt = VppBierTable(self, bti, 77)
         bt.add_vpp_config()
 
@@ -418,7 +481,7 @@ class TestBier(VppTestCase):
         #
         bier_route_1 = VppBierRoute(
             self, bti, 1,
-            [VppRoutePath("0.0.0.0",
+            [VppRoutePath(NH_ANY,
                           0xffffffff,
                           proto=FibPathProto.FIB_PATH_NH_PROTO_BIER,
                           nh_table_id=8)])
@@ -452,11 +515,10 @@ class TestBier(VppTestCase):
         p = (Ether(dst=self.pg0.local_mac, src=self.pg0.remote_mac) /
              MPLS(label=77, ttl=255) /
              BIER(length=BIERLength.BIER_LEN_256,
-                  BitString=scapy.compat.chb(255)*32,
+                  BitString=BS_ALL,
                   BFRID=99) /
              IP(src="1.1.1.1", dst="232.1.1.1") /
-             UDP(sport=1234, dport=1234) /
-             Raw())
+             UDP(sport=1234, dport=1234))
 
         self.send_and_expect(self.pg0, [p], self.pg1)
 
@@ -466,12 +528,11 @@ class TestBier(VppTestCase):
         p = (Ether(dst=self.pg0.local_mac, src=self.pg0.remote_mac) /
              MPLS(label=77, ttl=255) /
              BIER(length=BIERLength.BIER_LEN_256,
-                  BitString=scapy.compat.chb(255)*32,
+                  BitString=BS_ALL,
                   BFRID=77) /
              IP(src="1.1.1.1", dst="232.1.1.1") /
-             UDP(sport=1234, dport=1234) /
-             Raw())
-        self.send_and_assert_no_replies(self.pg0, p*2,
+             UDP(sport=1234, dport=1234))
+        self.send_and_assert_no_replies(self.pg0, [p] * 2,
                                         "no matching disposition entry")
 
         #
@@ -492,7 +553,7 @@ class TestBier(VppTestCase):
         # A multicast route to forward post BIER disposition that needs
         # a check against sending back into the BIER core
         #
-        bi = VppBierImp(self, bti, 333, scapy.compat.chb(0x3) * 32)
+        bi = VppBierImp(self, bti, 333, BS_3)
         bi.add_vpp_config()
 
         route_eg_232_1_1_2 = VppIpMRoute(
@@ -513,11 +574,10 @@ class TestBier(VppTestCase):
         p = (Ether(dst=self.pg0.local_mac, src=self.pg0.remote_mac) /
              MPLS(label=77, ttl=255) /
              BIER(length=BIERLength.BIER_LEN_256,
-                  BitString=scapy.compat.chb(255)*32,
+                  BitString=BS_ALL,
                   BFRID=77) /
              IP(src="1.1.1.1", dst="232.1.1.2") /
-             UDP(sport=1234, dport=1234) /
-             Raw())
+             UDP(sport=1234, dport=1234))
         self.send_and_expect(self.pg0, [p], self.pg1)
 
     def bier_e2e(self, hdr_len_id, n_bytes, max_bp):
@@ -585,14 +645,14 @@ class TestBier(VppTestCase):
         #
         bier_route_1 = VppBierRoute(
             self, bti, 1,
-            [VppRoutePath("0.0.0.0",
+            [VppRoutePath(NH_ANY,
                           0xffffffff,
                           proto=FibPathProto.FIB_PATH_NH_PROTO_BIER,
                           nh_table_id=8)])
         bier_route_1.add_vpp_config()
         bier_route_max = VppBierRoute(
             self, bti, max_bp,
-            [VppRoutePath("0.0.0.0",
+            [VppRoutePath(NH_ANY,
                           0xffffffff,
                           proto=FibPathProto.FIB_PATH_NH_PROTO_BIER,
                           nh_table_id=8)])
@@ -649,10 +709,11 @@ class TestBier(VppTestCase):
              UDP(sport=1234, dport=1234) /
              Raw(scapy.compat.chb(5) * 32))
 
-        rx = self.send_and_expect(self.pg0, p*NUM_PKTS, self.pg1)
+        rx = self.send_raw_and_expect(self.pg0, bytes(p), NUM_PKTS, self.pg1)
 
-        self.assertEqual(rx[0][IP].src, "1.1.1.1")
-        self.assertEqual(rx[0][IP].dst, "232.1.1.1")
+        ip = _layers(rx[0])['IP']
+        self.assertEqual(ip.src, "1.1.1.1")
+        self.assertEqual(ip.dst, "232.1.1.1")
 
         p = (Ether(dst=self.pg0.local_mac,
                    src=self.pg0.remote_mac) /
@@ -660,9 +721,10 @@ class TestBier(VppTestCase):
              UDP(sport=1234, dport=1234) /
              Raw(scapy.compat.chb(5) * 512))
 
-        rx = self.send_and_expect(self.pg0, p*NUM_PKTS, self.pg1)
-        self.assertEqual(rx[0][IP].src, "1.1.1.1")
-        self.assertEqual(rx[0][IP].dst, "232.1.1.2")
+        rx = self.send_raw_and_expect(self.pg0, bytes(p), NUM_PKTS, self.pg1)
+        ip = _layers(rx[0])['IP']
+        self.assertEqual(ip.src, "1.1.1.1")
+        self.assertEqual(ip.dst, "232.1.1.2")
 
     @unittest.skipUnless(running_extended_tests, "part of extended tests")
     def test_bier_e2e_1024(self):
@@ -694,7 +756,7 @@ class TestBier(VppTestCase):
         #
         # Add a BIER table for sub-domain 1, set 0, and BSL 256
         #
-        bti = VppBierTableID(1, 0, BIERLength.BIER_LEN_256)
+        bti = self.BTI_SD1
         bt = VppBierTable(self, bti, 77)
         bt.add_vpp_config()
 
@@ -716,7 +778,7 @@ class TestBier(VppTestCase):
 
         bier_route = VppBierRoute(
             self, bti, 1,
-            [VppRoutePath("0.0.0.0",
+            [VppRoutePath(NH_ANY,
                           0xFFFFFFFF,
                           type=FibPathType.FIB_PATH_TYPE_UDP_ENCAP,
                           next_hop_id=udp_encap.id)])
@@ -727,9 +789,9 @@ class TestBier(VppTestCase):
         # only use the second, but creating 2 tests with a non-zero
         # value index in the route add
         #
-        bi = VppBierImp(self, bti, 333, scapy.compat.chb(0xff) * 32)
+        bi = VppBierImp(self, bti, 333, BS_ALL)
         bi.add_vpp_config()
-        bi2 = VppBierImp(self, bti, 334, scapy.compat.chb(0xff) * 32)
+        bi2 = VppBierImp(self, bti, 334, BS_ALL)
         bi2.add_vpp_config()
 
         #
@@ -766,15 +828,16 @@ class TestBier(VppTestCase):
         #
         # Encap Stack is, eth, IP, UDP, BIFT, BIER
         #
-        self.assertEqual(rx[0][IP].src, self.pg0.local_ip4)
-        self.assertEqual(rx[0][IP].dst, nh1)
-        self.assertEqual(rx[0][UDP].sport, 330)
-        self.assertEqual(rx[0][UDP].dport, 8138)
-        self.assertEqual(rx[0][BIFT].bsl, BIERLength.BIER_LEN_256)
-        self.assertEqual(rx[0][BIFT].sd, 1)
-        self.assertEqual(rx[0][BIFT].set, 0)
-        self.assertEqual(rx[0][BIFT].ttl, 64)
-        self.assertEqual(rx[0][BIER].length, 2)
+        layers = _layers(rx[0])
+        self.assertEqual(layers['IP'].src, self.pg0.local_ip4)
+        self.assertEqual(layers['IP'].dst, nh1)
+        self.assertEqual(layers['UDP'].sport, 330)
+        self.assertEqual(layers['UDP'].dport, 8138)
+        self.assertEqual(layers['BIFT'].bsl, BIERLength.BIER_LEN_256)
+        self.assertEqual(layers['BIFT'].sd, 1)
+        self.assertEqual(layers['BIFT'].set, 0)
+        self.assertEqual(layers['BIFT'].ttl, 64)
+        self.assertEqual(layers['BIER'].length, 2)
 
     def test_bier_tail_o_udp(self):
         """BIER Tail over UDP"""
@@ -782,7 +845,7 @@ class TestBier(VppTestCase):
         #
         # Add a BIER table for sub-domain 0, set 0, and BSL 256
         #
-        bti = VppBierTableID(1, 0, BIERLength.BIER_LEN_256)
+        bti = self.BTI_SD1
         bt = VppBierTable(self, bti, MPLS_LABEL_INVALID)
         bt.add_vpp_config()
 
@@ -797,7 +860,7 @@ class TestBier(VppTestCase):
         #
         bier_route_1 = VppBierRoute(
             self, bti, 1,
-            [VppRoutePath("0.0.0.0",
+            [VppRoutePath(NH_ANY,
                           0xffffffff,
                           proto=FibPathProto.FIB_PATH_NH_PROTO_BIER,
                           nh_table_id=8)])
@@ -833,11 +896,10 @@ class TestBier(VppTestCase):
              UDP(sport=333, dport=8138) /
              BIFT(sd=1, set=0, bsl=2, ttl=255) /
              BIER(length=BIERLength.BIER_LEN_256,
-                  BitString=scapy.compat.chb(255)*32,
+                  BitString=BS_ALL,
                   BFRID=99) /
              IP(src="1.1.1.1", dst="232.1.1.1") /
-             UDP(sport=1234, dport=1234) /
-             Raw())
+             UDP(sport=1234, dport=1234))
 
         rx = self.send_and_expect(self.pg0, [p], self.pg1)
 
@@ -4,7 +4,7 @@
 """
 import logging
 
-from ipaddress import ip_address
+from ipaddress import ip_address, IPv4Address, IPv6Address
 from socket import AF_INET, AF_INET6
 from vpp_papi import VppEnum
 try:
@@ -37,7 +37,10 @@ def get_dpo_proto(addr):
 class VppIpAddressUnion():
     def __init__(self, addr):
         self.addr = addr
-        self.ip_addr = ip_address(text_type(self.addr))
+        if isinstance(addr, (IPv4Address, IPv6Address)):
+            self.ip_addr = addr
+        else:
+            self.ip_addr = ip_address(text_type(self.addr))
 
     def encode(self):
         if self.version == 6:
@@ -361,6 +361,9 @@ class VppFibPathNextHop(object):
 
 class VppRoutePath(object):
 
+    __slots__ = ('nh_itf', 'nh_table_id', 'nh_labels', 'weight', 'rpf_id',
+                 'proto', 'flags', 'type', 'nh', 'next_hop_id')
+
     def __init__(
             self,
             nh_addr,
@@ -435,6 +438,8 @@ class VppRoutePath(object):
 
 class VppMRoutePath(VppRoutePath):
 
+    __slots__ = ('nh_i_flags', 'bier_imp')
+
     def __init__(self, nh_sw_if_index, flags,
                  nh=None,
                  proto=FibPathProto.FIB_PATH_NH_PROTO_IP4,
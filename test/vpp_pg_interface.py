@@ -159,11 +159,11 @@ class VppPGInterface(VppInterface):
     def disable_capture(self):
         self.test.vapi.cli("%s disable" % self.capture_cli)
 
-    def add_stream(self, pkts, nb_replays=None, worker=None):
+    def _add_stream(self, write, nb_replays, worker):
         """
-        Add a stream of packets to this packet-generator
+        Write the input pcap file and load it into this packet-generator
 
-        :param pkts: iterable packets
+        :param write: function writing the pcap file to the path it is given
 
         """
         self._worker = worker
@@ -171,11 +171,39 @@ class VppPGInterface(VppInterface):
         self._rename_previous_capture_file(self.in_path,
                                            self.in_history_counter,
                                            self._in_file)
-        wrpcap(self.in_path, pkts)
+        write(self.in_path)
         self.test.register_capture(self.cap_name)
         # FIXME this should be an API, but no such exists atm
         self.test.vapi.cli(self.input_cli)
 
+    def add_stream(self, pkts, nb_replays=None, worker=None):
+        """
+        Add a stream of packets to this packet-generator
+
+        :param pkts: iterable packets
+
+        """
+        self._add_stream(lambda path: wrpcap(path, pkts), nb_replays, worker)
+
+    def add_stream_raw(self, raw, count, worker=None):
+        """
+        Add a stream of identical packets to this packet-generator,
+        writing the pcap records directly rather than through scapy
+
+        :param raw: bytes of the ethernet frame to inject
+        :param count: number of copies of the frame in the stream
+
+        """
+        def write(path):
+            # pcap global header: magic, v2.4, tz, sigfigs, snaplen, ethernet
+            hdr = struct.pack("IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+            record = struct.pack("IIII", 0, 0, len(raw), len(raw)) + raw
+            with open(path, "wb") as f:
+                f.write(hdr)
+                f.write(record * count)
+
+        self._add_stream(write, None, worker)
+
     def generate_debug_aid(self, kind):
         """ Create a hardlink to the out file with a counter and a file
         containing stack trace to ease debugging in case of multiple capture
@@ -337,6 +365,67 @@ class VppPGInterface(VppInterface):
             return False
         return True
 
+    @staticmethod
+    def _read_pcap_records(f, endian):
+        """ Skip over the complete packet records from the current position
+        of pcap file f, leaving it at the start of the first incomplete one
+
+        :returns: number of records skipped
+        """
+        count = 0
+        size = os.fstat(f.fileno()).st_size
+        while True:
+            pos = f.tell()
+            rec = f.read(16)
+            if len(rec) < 16:
+                f.seek(pos)
+                break
+            sec, usec, caplen, wirelen = struct.unpack(endian + "IIII", rec)
+            if pos + len(rec) + caplen > size:
+                f.seek(pos)
+                break
+            f.seek(caplen, 1)
+            count += 1
+        return count
+
+    def wait_for_n_packets(self, n, timeout=1):
+        """
+        Wait until at least n packets are present in the capture file,
+        counting the pcap records without dissecting the packets
+
+        :param n: number of packets to wait for
+        :param timeout: How long to wait for the packets (default 1s)
+
+        :returns: True/False if the packets are present or appear within
+                  timeout
+        """
+        deadline = time.time() + timeout
+        if not self.wait_for_capture_file(timeout):
+            return False
+        count = 0
+        endian = None
+        with open(self.out_path, "rb") as f:
+            while True:
+                if endian is None:
+                    hdr = f.read(24)
+                    if len(hdr) == 24:
+                        magic, = struct.unpack("<I", hdr[:4])
+                        endian = "<" if magic in (0xa1b2c3d4,
+                                                  0xa1b23c4d) else ">"
+                    else:
+                        f.seek(0)
+                if endian is not None:
+                    # only the records added since the last pass are read
+                    count += self._read_pcap_records(f, endian)
+                if count >= n:
+                    return True
+                if time.time() >= deadline:
+                    self.test.logger.debug(
+                        "Timeout waiting for %d packets in capture file %s, "
+                        "captured %d" % (n, self.out_path, count))
+                    return False
+                self._test.sleep(0.01)  # yield
+
     def verify_enough_packet_data_in_pcap(self):
         """
         Check if enough data is available in file handled by internal pcap